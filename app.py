@@ -1,7 +1,7 @@
 import re
 from dotenv import load_dotenv
 print("--- App execution started ---", flush=True)
-from flask import Flask, render_template, request, Response
+from flask import Flask, render_template, request, Response, jsonify
 import html
 from better_profanity import profanity
 
@@ -9,7 +9,7 @@ from better_profanity import profanity
 load_dotenv()
 
 # Import from our project files
-from generator import generate_scenario
+from generator import generate_scenario, generate_variants, BRANCH_POINTS
 from llm_config import llm_providers
 from chat import get_llm_instance
 from pdf_generator import create_pdf
@@ -17,6 +17,9 @@ from config import PDF_TEMPLATE_PATH
 
 app = Flask(__name__)
 
+# Upper bound on the number of variants requested through /generate_variants
+MAX_VARIANTS = 5
+
 import string
 
 def validate_and_sanitize_inputs(data):
@@ -66,16 +69,68 @@ def generate():
 
     def stream_response():
         """Generator function to stream content."""
+        metrics = {}
+        scenario = generate_scenario(llm=llm, inputs=data, language=language, metrics=metrics)
         try:
-            for html_brick in generate_scenario(llm=llm, inputs=data, language=language):
+            for html_brick in scenario:
                 yield html_brick
         except Exception as e:
             app.logger.error(f"An error occurred during scenario generation: {e}")
             error_html = f"<div style='color: red; padding: 1em; border: 1px solid red; margin-top: 1em;'><strong>Error during generation:</strong><br>{e}</div>"
             yield error_html
+        finally:
+            # Closing the generator discards unused speculative work (e.g. on client disconnect).
+            scenario.close()
+            app.logger.info(f"Speculation stats: {metrics['speculation']}")
 
     return Response(stream_response(), mimetype='text/html')
 
+@app.route('/generate_variants', methods=['POST'])
+def generate_variants_route():
+    """
+    Generates several variants of a scenario that share the steps before the chosen branch
+    point, and returns them side by side as JSON.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"error": "Invalid JSON payload."}), 400
+
+    try:
+        data = validate_and_sanitize_inputs(data)
+    except ValueError as e:
+        return jsonify({"error": f"Validation Error: {e}"}), 400
+
+    branch_at = data.get('branch_at', 'hook')
+    if branch_at not in BRANCH_POINTS:
+        return jsonify({"error": f"Invalid branch_at '{branch_at}'. Expected one of: {', '.join(BRANCH_POINTS)}"}), 400
+    try:
+        variant_count = min(max(int(data.get('variant_count', 3)), 1), MAX_VARIANTS)
+    except (ValueError, TypeError):
+        return jsonify({"error": "variant_count must be an integer."}), 400
+
+    selected_model = data.get('model', 'gemini-flash')
+    language = data.get('language', 'French') # Default to French
+    try:
+        llm = get_llm_instance(selected_model)
+    except Exception as e:
+        app.logger.error(f"Failed to initialize LLM '{selected_model}': {e}")
+        return jsonify({"error": f"Could not initialize the Language Model '{selected_model}'. Check config and keys."}), 500
+
+    shared_html = ""
+    variants_html = []
+    try:
+        for variant, html_brick in generate_variants(llm=llm, inputs=data, variant_count=variant_count, branch_at=branch_at, language=language):
+            if variant is None:
+                shared_html += html_brick
+            else:
+                variants_html.extend([""] * (variant + 1 - len(variants_html)))
+                variants_html[variant] += html_brick
+    except Exception as e:
+        app.logger.error(f"An error occurred during variant generation: {e}")
+        return jsonify({"error": f"Error during generation: {e}"}), 500
+
+    return jsonify({"branch_at": branch_at, "shared": shared_html, "variants": variants_html})
+
 @app.route('/download_pdf', methods=['POST'])
 def download_pdf():
     """
@@ -0,0 +1,271 @@
+"""
+Batch scenario generation.
+
+Reads job specs from a JSONL file (one JSON object per line, with the same fields as the
+web form: game_system, player_count, theme_tone, core_idea, ..., plus model and language),
+runs them across a worker pool and writes each scenario as HTML, structured JSON and
+optionally PDF.
+
+Progress is checkpointed in the output directory, so an interrupted batch can simply be
+relaunched: finished jobs are skipped and failed ones are retried.
+
+Usage:
+    python batch.py jobs.jsonl --output-dir batch_output --workers 4 --max-per-model 2 --pdf
+"""
+import os
+import re
+import json
+import hashlib
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+from langchain_core.callbacks import UsageMetadataCallbackHandler
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Import from our project files
+from generator import generate_scenario
+from chat import get_llm_instance
+from pdf_generator import create_pdf
+from config import PDF_TEMPLATE_PATH
+
+CHECKPOINT_FILENAME = "checkpoint.jsonl"
+DEFAULT_MODEL = "gemini-flash"
+DEFAULT_LANGUAGE = "French"
+# How often a job waiting for a global slot checks whether the batch was interrupted
+SLOT_POLL_SECONDS = 0.5
+
+
+def load_jobs(jobs_path):
+    """
+    Loads job specs from a JSONL file, skipping blank lines.
+    Each job gets a 'job_id', taken from 'job_id' or 'request_id'. Otherwise it is derived
+    from a hash of the job's content, so it stays the same when lines are added or removed.
+    """
+    jobs = []
+    with open(jobs_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Invalid JSON on line {line_number} of {jobs_path}: {e}")
+            job_id = job.get("job_id") or job.get("request_id")
+            if not job_id:
+                content = json.dumps(job, sort_keys=True, ensure_ascii=False)
+                job_id = "job-" + hashlib.sha1(content.encode('utf-8')).hexdigest()[:12]
+            job_id = str(job_id)
+            job["job_id"] = re.sub(r'[^\w.-]+', '_', job_id)
+            jobs.append(job)
+
+    seen = set()
+    for job in jobs:
+        if job["job_id"] in seen:
+            raise ValueError(f"Duplicate job id in {jobs_path}: {job['job_id']}. Give identical jobs distinct 'job_id' values.")
+        seen.add(job["job_id"])
+    return jobs
+
+
+def load_checkpoint(checkpoint_path):
+    """
+    Reads the checkpoint file and returns the latest record for each job id.
+    """
+    records = {}
+    if not os.path.exists(checkpoint_path):
+        return records
+    with open(checkpoint_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line truncated by an interrupted run; the job will simply be redone.
+                continue
+            records[record["job_id"]] = record
+    return records
+
+
+class BatchRunner:
+    """
+    Runs scenario jobs with one thread pool per model, so that a model at its concurrency
+    limit never keeps jobs for other models waiting. A global slot count bounds the total.
+    """
+
+    def __init__(self, output_dir, workers=4, max_per_model=2, pdf=False):
+        self.output_dir = output_dir
+        self.workers = workers
+        self.max_per_model = max_per_model
+        self.pdf = pdf
+        self.checkpoint_path = os.path.join(output_dir, CHECKPOINT_FILENAME)
+        self._checkpoint_lock = threading.Lock()
+        # Only held while a job runs, so a thread waiting for a slot never blocks other models.
+        self._slots = threading.BoundedSemaphore(workers)
+        # Set on interruption, so that jobs still waiting for a slot give up.
+        self._stopping = threading.Event()
+
+    def _write_checkpoint(self, record):
+        with self._checkpoint_lock:
+            with open(self.checkpoint_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+
+    def run_job(self, job):
+        """
+        Runs one job and checkpoints its outcome from the worker thread, so that jobs
+        finishing after an interruption are still recorded. Returns the checkpoint record,
+        or None if the batch was interrupted before the job got a slot (it stays pending).
+        """
+        # The executor already counts this job as running, so cancel_futures cannot drop it.
+        while not self._slots.acquire(timeout=SLOT_POLL_SECONDS):
+            if self._stopping.is_set():
+                return None
+        try:
+            if self._stopping.is_set():
+                return None
+            try:
+                record = self._generate(job)
+            except Exception as e:
+                record = {"job_id": job["job_id"], "status": "failed", "error": str(e)}
+        finally:
+            self._slots.release()
+        self._write_checkpoint(record)
+        return record
+
+    def _generate(self, job):
+        """
+        Generates one scenario and writes its outputs. Returns the checkpoint record.
+        """
+        job_id = job["job_id"]
+        model = job.get("model", DEFAULT_MODEL)
+        language = job.get("language", DEFAULT_LANGUAGE)
+
+        start = time.monotonic()
+        llm = get_llm_instance(model)
+        usage_handler = UsageMetadataCallbackHandler()
+        outputs = {}
+        # No speculation: it would add provider calls beyond what --max-per-model allows.
+        html_bricks = list(generate_scenario(
+            llm=llm, inputs=job, language=language, outputs=outputs, callbacks=[usage_handler], speculative=False
+        ))
+        elapsed = time.monotonic() - start
+
+        usage = usage_handler.usage_metadata
+        total_tokens = sum(model_usage.get("total_tokens", 0) for model_usage in usage.values())
+        html_content = "".join(html_bricks)
+
+        base_path = os.path.join(self.output_dir, job_id)
+        with open(base_path + ".html", 'w', encoding='utf-8') as f:
+            f.write(html_content)
+        with open(base_path + ".json", 'w', encoding='utf-8') as f:
+            json.dump({
+                "job_id": job_id,
+                "model": model,
+                "language": language,
+                "inputs": {k: v for k, v in job.items() if k not in ("job_id", "model", "language")},
+                "steps": outputs,
+                "html": html_content,
+                "usage": usage,
+                "total_tokens": total_tokens,
+                "elapsed_seconds": round(elapsed, 2),
+            }, f, ensure_ascii=False, indent=2)
+        if self.pdf:
+            pdf_bytes = create_pdf(html_content, PDF_TEMPLATE_PATH, job.get("theme_tone", "Default"))
+            with open(base_path + ".pdf", 'wb') as f:
+                f.write(pdf_bytes)
+
+        return {
+            "job_id": job_id,
+            "status": "done",
+            "model": model,
+            "elapsed_seconds": round(elapsed, 2),
+            "total_tokens": total_tokens,
+        }
+
+    def run(self, jobs):
+        """
+        Runs every job not already marked as done in the checkpoint, and returns a summary.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        previous = load_checkpoint(self.checkpoint_path)
+        pending = [job for job in jobs if previous.get(job["job_id"], {}).get("status") != "done"]
+        skipped = len(jobs) - len(pending)
+        if skipped:
+            logging.info(f"Skipping {skipped} job(s) already completed in {self.checkpoint_path}.")
+
+        done, failed, total_tokens = 0, 0, 0
+        start = time.monotonic()
+        executors = {}
+        futures = []
+        for job in pending:
+            model = job.get("model", DEFAULT_MODEL)
+            if model not in executors:
+                executors[model] = ThreadPoolExecutor(max_workers=min(self.max_per_model, self.workers))
+            futures.append(executors[model].submit(self.run_job, job))
+        try:
+            for index, future in enumerate(as_completed(futures), start=1):
+                record = future.result()
+                if record is None:
+                    continue
+                if record["status"] == "done":
+                    done += 1
+                    total_tokens += record["total_tokens"]
+                    logging.info(f"[{index}/{len(pending)}] Job '{record['job_id']}' done in {record['elapsed_seconds']}s ({record['total_tokens']} tokens).")
+                else:
+                    failed += 1
+                    logging.error(f"[{index}/{len(pending)}] Job '{record['job_id']}' failed: {record['error']}")
+        except KeyboardInterrupt:
+            # Drop the queued jobs and those waiting for a slot; the running ones finish
+            # and checkpoint themselves.
+            logging.warning("Interrupted: cancelling queued jobs and waiting for running ones to finish.")
+            self._stopping.set()
+            for executor in executors.values():
+                executor.shutdown(wait=False, cancel_futures=True)
+            for executor in executors.values():
+                executor.shutdown(wait=True)
+            raise
+        for executor in executors.values():
+            executor.shutdown(wait=True)
+        elapsed = time.monotonic() - start
+
+        return {
+            "jobs": len(jobs),
+            "skipped": skipped,
+            "done": done,
+            "failed": failed,
+            "elapsed_seconds": round(elapsed, 2),
+            "scenarios_per_hour": round(done * 3600 / elapsed, 2) if done and elapsed else 0.0,
+            "tokens_per_scenario": round(total_tokens / done) if done else 0,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate RPG scenarios in bulk from a JSONL job file.")
+    parser.add_argument("jobs", help="Path to the JSONL file containing one job per line.")
+    parser.add_argument("--output-dir", default="batch_output", help="Directory for the generated files and the checkpoint.")
+    parser.add_argument("--workers", type=int, default=4, help="Maximum number of jobs run in parallel, across all models.")
+    parser.add_argument("--max-per-model", type=int, default=2, help="Maximum number of concurrent jobs per model.")
+    parser.add_argument("--pdf", action="store_true", help="Also export each scenario as PDF.")
+    args = parser.parse_args()
+
+    jobs = load_jobs(args.jobs)
+    runner = BatchRunner(args.output_dir, workers=args.workers, max_per_model=args.max_per_model, pdf=args.pdf)
+    summary = runner.run(jobs)
+
+    logging.info(
+        f"Batch finished: {summary['done']} done, {summary['failed']} failed, {summary['skipped']} skipped "
+        f"in {summary['elapsed_seconds']}s ({summary['scenarios_per_hour']} scenarios/hour, "
+        f"{summary['tokens_per_scenario']} tokens/scenario)."
+    )
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -73,9 +73,12 @@ def get_llm_instance(model_name: str):
             timeout=timeout,
         ).chat.completions
 
+        # Streamed calls only report token usage when asked to. Some OpenAI-compatible
+        # servers reject the extra stream option, so it is opt-in for them.
         return ChatOpenAI(
             model=config_model_name,
-            client=http_client
+            client=http_client,
+            stream_usage=provider_config.get("stream_usage", service == "openai")
         )
 
     elif service == "mistral":
@@ -1,202 +1,498 @@
 import markdown2
 import html
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
+MARKDOWN_OPTIONS = ["fenced-code-blocks", "tables", "header-ids"]
+
+# Agent definitions are generic, as the specific context
+# will be passed in the prompt for each task.
+AGENTS = {
+    "ideateur": {
+        "role": "Idéateur de Concept",
+        "goal": "À partir du contexte fourni par l'utilisateur, proposer {hook_count} accroches de scénario fortes, originales et jouables.",
+        "backstory": "Tu es un maître conteur visionnaire. Ton rôle est de poser les premières pierres d’une grande histoire en t'inspirant des idées de l'utilisateur pour créer des situations intrigantes qui suscitent immédiatement la curiosité.",
+    },
+    "stratege": {
+        "role": "Stratège Antagoniste",
+        "goal": "À partir de l’accroche choisie et du contexte général, concevoir l’adversité centrale du scénario en créant un antagoniste fort et cohérent.",
+        "backstory": "Tu es un maître tacticien spécialisé dans la création d’antagonistes mémorables. Ton travail est de forger une figure d’adversité qui soit un reflet des thèmes de l’histoire et un moteur pour le conflit.",
+    },
+    "contextualisateur": {
+        "role": "Architecte de Contexte Narratif",
+        "goal": "Créer un cadre immersif et jouable pour l’histoire, en se basant sur le contexte utilisateur, l'accroche et l'antagoniste.",
+        "backstory": "Ancien game designer, tu sais créer des mondes où chaque détail sert l’aventure. Tu détestes les mondes 'génériques' et adores les contrastes.",
+    },
+    "dramaturge": {
+        "role": "Dramaturge",
+        "goal": "Construire la structure globale de l'histoire. Élaborer le synopsis avec un début, un milieu et une fin clairs.",
+        "backstory": "Tu es un scénariste chevronné, spécialisé dans la construction d'arcs narratifs puissants pour maintenir l'intérêt des joueurs.",
+    },
+    "metteur_en_scene": {
+        "role": "Metteur en Scène",
+        "goal": "Transformer le synopsis en une liste claire de scènes jouables, chacune avec un objectif, des obstacles et une ambiance.",
+        "backstory": "Tu es un réalisateur narratif, pensant en séquences et en moments de jeu pour rendre l'histoire concrète et passionnante.",
+    },
+    "specialiste_scene": {
+        "role": "Spécialiste de Scène",
+        "goal": "Développer en détail chaque scène à partir du squelette fourni, en décrivant la situation, les obstacles et les issues possibles.",
+        "backstory": "Tu es un concepteur de situations de jeu immersives, transformant une idée de scène en une expérience vivante et détaillée.",
+    },
+    "architecte_pnj": {
+        "role": "Architecte des PNJ",
+        "goal": "Dresser les fiches des PNJ majeurs (alliés, neutres, antagonistes) avec identité, personnalité, et motivations.",
+        "backstory": "Expert en psychologie, tu sais que des PNJ mémorables sont la clé d'un monde vivant. Tu crées des individus crédibles et utiles à l'histoire. Présente chaque personnage avec le nom en titre et les éléments suivant à la ligne en mettant en avant leurs titres en gras.",
+    },
+    "architecte_lieux": {
+        "role": "Architecte des Lieux",
+        "goal": "Détailler les lieux importants du scénario avec une description sensorielle globale, une fonction narrative et des opportunités de jeu. Présente chaque lieu avec le nom en titre et les éléments suivant à la ligne en mettant en avant leurs titres en gras.",
+        "backstory": "Tu es un urbaniste de l'imaginaire, concevant des lieux qui sont des acteurs à part entière de l'histoire.",
+    },
+    "verificateur": {
+        "role": "Vérificateur de Cohérence Narrative",
+        "goal": "Assurer la logique et la cohésion globale du scénario à travers les différentes étapes de sa création.",
+        "backstory": "Tu es un contrôleur qualité narratif avec un œil de lynx pour les détails. Tu garantis que le produit final soit un tout harmonieux.",
+    },
+    "generateur_titre": {
+        "role": "Générateur de Titre",
+        "goal": "À partir de l'accroche d'un scénario, créer un titre percutant et mémorable.",
+        "backstory": "Tu es un publicitaire spécialisé dans la création de titres accrocheurs. Tu sais comment capturer l'essence d'une histoire en quelques mots.",
+    },
+}
+
+# Steps where a multi-variant generation can branch, mapped to the first step run per variant.
+BRANCH_POINTS = {
+    "hook": "titre",
+    "antagonist": "antagoniste",
+    "synopsis": "synopsis",
+}
+
+# Steps that only depend on the selected hook, and can therefore start speculatively as
+# soon as the first hook has been streamed by the ideation step.
+SPECULATIVE_STEPS = ("titre", "antagoniste")
+
 def _create_chain(llm, prompt_template):
     """Creates a simple Langchain chain."""
     prompt = ChatPromptTemplate.from_template(prompt_template)
     return prompt | llm | StrOutputParser()
 
-def generate_scenario(llm, inputs, language="French"):
-    """
-    Generates a scenario by yielding each step as an HTML brick, using a flexible input structure.
-    """
-    markdown_options = ["fenced-code-blocks", "tables", "header-ids"]
-
-    # Extract user inputs with defaults for safety
-    user_context = {
-        "game_system": inputs.get("game_system", "Non spécifié"),
-        "player_count": inputs.get("player_count", "Non spécifié"),
-        "theme_tone": inputs.get("theme_tone", "Non spécifié"),
-        "core_idea": inputs.get("core_idea", "Non spécifié"),
-        "constraints": inputs.get("constraints", "Aucune"),
-        "key_elements": inputs.get("key_elements", "Non spécifiés"),
-        "elements_to_avoid": inputs.get("elements_to_avoid", "Aucun"),
-    }
-
-    # Agent definitions are updated to be more generic, as the specific context
-    # will be passed in the prompt for each task.
-    agents = {
-        "ideateur": {
-            "role": "Idéateur de Concept",
-            "goal": "À partir du contexte fourni par l'utilisateur, proposer 2 à 3 accroches de scénario fortes, originales et jouables.",
-            "backstory": "Tu es un maître conteur visionnaire. Ton rôle est de poser les premières pierres d’une grande histoire en t'inspirant des idées de l'utilisateur pour créer des situations intrigantes qui suscitent immédiatement la curiosité.",
-        },
-        "stratege": {
-            "role": "Stratège Antagoniste",
-            "goal": "À partir de l’accroche choisie et du contexte général, concevoir l’adversité centrale du scénario en créant un antagoniste fort et cohérent.",
-            "backstory": "Tu es un maître tacticien spécialisé dans la création d’antagonistes mémorables. Ton travail est de forger une figure d’adversité qui soit un reflet des thèmes de l’histoire et un moteur pour le conflit.",
-        },
-        "contextualisateur": {
-            "role": "Architecte de Contexte Narratif",
-            "goal": "Créer un cadre immersif et jouable pour l’histoire, en se basant sur le contexte utilisateur, l'accroche et l'antagoniste.",
-            "backstory": "Ancien game designer, tu sais créer des mondes où chaque détail sert l’aventure. Tu détestes les mondes 'génériques' et adores les contrastes.",
-        },
-        "dramaturge": {
-            "role": "Dramaturge",
-            "goal": "Construire la structure globale de l'histoire. Élaborer le synopsis avec un début, un milieu et une fin clairs.",
-            "backstory": "Tu es un scénariste chevronné, spécialisé dans la construction d'arcs narratifs puissants pour maintenir l'intérêt des joueurs.",
-        },
-        "metteur_en_scene": {
-            "role": "Metteur en Scène",
-            "goal": "Transformer le synopsis en une liste claire de scènes jouables, chacune avec un objectif, des obstacles et une ambiance.",
-            "backstory": "Tu es un réalisateur narratif, pensant en séquences et en moments de jeu pour rendre l'histoire concrète et passionnante.",
-        },
-        "specialiste_scene": {
-            "role": "Spécialiste de Scène",
-            "goal": "Développer en détail chaque scène à partir du squelette fourni, en décrivant la situation, les obstacles et les issues possibles.",
-            "backstory": "Tu es un concepteur de situations de jeu immersives, transformant une idée de scène en une expérience vivante et détaillée.",
-        },
-        "architecte_pnj": {
-            "role": "Architecte des PNJ",
-            "goal": "Dresser les fiches des PNJ majeurs (alliés, neutres, antagonistes) avec identité, personnalité, et motivations.",
-            "backstory": "Expert en psychologie, tu sais que des PNJ mémorables sont la clé d'un monde vivant. Tu crées des individus crédibles et utiles à l'histoire. Présente chaque personnage avec le nom en titre et les éléments suivant à la ligne en mettant en avant leurs titres en gras.",
-        },
-        "architecte_lieux": {
-            "role": "Architecte des Lieux",
-            "goal": "Détailler les lieux importants du scénario avec une description sensorielle globale, une fonction narrative et des opportunités de jeu. Présente chaque lieu avec le nom en titre et les éléments suivant à la ligne en mettant en avant leurs titres en gras.",
-            "backstory": "Tu es un urbaniste de l'imaginaire, concevant des lieux qui sont des acteurs à part entière de l'histoire.",
-        },
-        "verificateur": {
-            "role": "Vérificateur de Cohérence Narrative",
-            "goal": "Assurer la logique et la cohésion globale du scénario à travers les différentes étapes de sa création.",
-            "backstory": "Tu es un contrôleur qualité narratif avec un œil de lynx pour les détails. Tu garantis que le produit final soit un tout harmonieux.",
-        },
-        "generateur_titre": {
-            "role": "Générateur de Titre",
-            "goal": "À partir de l'accroche d'un scénario, créer un titre percutant et mémorable.",
-            "backstory": "Tu es un publicitaire spécialisé dans la création de titres accrocheurs. Tu sais comment capturer l'essence d'une histoire en quelques mots.",
-        },
-    }
+def _markdown(text):
+    return markdown2.markdown(text, extras=MARKDOWN_OPTIONS)
 
-    def _run_task(agent_name, task_description, language, **kwargs):
-        agent = agents[agent_name]
-        # Filter out any values that are None or "N/A" to keep the prompt clean
-        clean_kwargs = {k: v for k, v in kwargs.items() if v and v != "Non spécifié"}
-        context_inputs = "\n\n".join([f"**{key.replace('_', ' ').capitalize()}**:\n{value}" for key, value in clean_kwargs.items()])
+def _build_task(state, agent_name, task_description, goal=None, **kwargs):
+    agent = AGENTS[agent_name]
+    goal = goal or agent['goal']
+    # Filter out any values that are None or "N/A" to keep the prompt clean
+    clean_kwargs = {k: v for k, v in kwargs.items() if v and v != "Non spécifié"}
+    context_inputs = "\n\n".join([f"**{key.replace('_', ' ').capitalize()}**:\n{value}" for key, value in clean_kwargs.items()])
 
-        prompt_template = f"""
+    prompt_template = f"""
 **Rôle**: {agent['role']}
-**Objectif**: {agent['goal']}
+**Objectif**: {goal}
 **Contexte de la Tâche**:
 {context_inputs}
 
 **Tâche à réaliser**:
 {task_description}
 
-**Instruction finale**: Rédige la réponse en {language}.
+**Instruction finale**: Rédige la réponse en {state['language']}.
 """
-        chain = _create_chain(llm, prompt_template)
-        return chain.invoke(clean_kwargs)
+    return _create_chain(state["llm"], prompt_template), clean_kwargs
+
+def _run_task(state, agent_name, task_description, goal=None, **kwargs):
+    chain, clean_kwargs = _build_task(state, agent_name, task_description, goal, **kwargs)
+    return chain.invoke(clean_kwargs, config={"callbacks": state["callbacks"]})
+
+def _stream_task(state, agent_name, task_description, goal=None, **kwargs):
+    chain, clean_kwargs = _build_task(state, agent_name, task_description, goal, **kwargs)
+    return chain.stream(clean_kwargs, config={"callbacks": state["callbacks"]})
+
+# --- Speculative Execution ---
+# While the ideation step is still streaming, the steps in state["speculative_steps"] are
+# started with the first complete hook, which is the one selected. _run_pipeline adopts
+# their result when it reaches them. If the run stops before that (an error, or the client
+# going away), they are discarded as wasted work. Statistics go to state["metrics"].
+
+def _run_speculative_step(state, name, step, hook):
+    shadow_state = dict(state, outputs={"accroche": hook})
+    start = time.monotonic()
+    html_brick = step(shadow_state)
+    return html_brick, shadow_state["outputs"][name], time.monotonic() - start
 
-    # --- Step 1: Generate initial ideas ---
-    task_ideation_output = _run_task(
+def _start_speculation(state, hook):
+    steps = dict(PIPELINE)
+    names = state["speculative_steps"]
+    # A single worker: with the ideation stream still open, this caps a scenario at two
+    # provider calls in flight. The steps run in SPECULATIVE_STEPS order.
+    executor = ThreadPoolExecutor(max_workers=1)
+    state["speculation"] = {
+        name: {
+            "future": executor.submit(_run_speculative_step, state, name, steps[name], hook),
+            "started": time.monotonic(),
+        }
+        for name in names
+    }
+    state["metrics"]["speculation"]["started"].extend(names)
+    # Running tasks keep going; this only releases the worker threads once they are done.
+    executor.shutdown(wait=False)
+
+def _adopt_speculation(state, name, speculation):
+    wait_start = time.monotonic()
+    html_brick, output, duration = speculation["future"].result()
+    waited = time.monotonic() - wait_start
+    state["outputs"][name] = output
+    stats = state["metrics"]["speculation"]
+    stats["adopted"].append(name)
+    # Without speculation the whole step duration would have been spent waiting.
+    stats["time_saved_seconds"] = round(stats["time_saved_seconds"] + max(duration - waited, 0), 2)
+    return html_brick
+
+def _discard_speculation(state):
+    stats = state["metrics"]["speculation"]
+    for name, speculation in state.pop("speculation", {}).items():
+        future = speculation["future"]
+        if future.cancel():
+            wasted = 0
+        elif future.done() and not future.exception():
+            wasted = future.result()[2]
+        else:
+            # Still running: an in-flight LLM call cannot be interrupted, its result is ignored.
+            wasted = time.monotonic() - speculation["started"]
+        stats["discarded"].append(name)
+        stats["wasted_seconds"] = round(stats["wasted_seconds"] + wasted, 2)
+
+def _variant_context(state):
+    """
+    Returns the task suffix and extra context steering a branch step away from the
+    variants already generated (see generate_variants).
+    """
+    previous_variants = state.get("previous_variants")
+    if not previous_variants:
+        return "", {}
+    note = " D'autres variantes ont déjà été proposées (voir « Variantes deja proposees ») : propose une version nettement différente, sans reprendre leurs idées principales."
+    return note, {"variantes_deja_proposees": "\n\n---\n\n".join(previous_variants)}
+
+# --- Pipeline Steps ---
+# Each step reads what it needs from state["outputs"], stores its own raw output there
+# and returns the HTML brick to display.
+
+def _step_ideation(state):
+    """Streams the hooks, yielding each one as soon as its paragraph is complete."""
+    outputs = state["outputs"]
+    hook_count = state.get("hook_count", "2 à 3")
+    task_ideation_output = ""
+    hooks = []
+    for chunk in _stream_task(
+        state,
         "ideateur",
-        "Génère 2 à 3 accroches de scénario distinctes et percutantes basées sur le contexte fourni. Chaque accroche doit être un court paragraphe intrigant. Commence directement par la première accroche, sans phrase d'introduction.",
-        language,
-        **user_context
-    )
-    yield f"{markdown2.markdown(task_ideation_output, extras=markdown_options)}"
-    hooks = [hook.strip() for hook in task_ideation_output.split('\n\n') if hook.strip()]
-    accroche_selectionnee = hooks[0] if hooks else task_ideation_output
+        f"Génère {hook_count} accroches de scénario distinctes et percutantes basées sur le contexte fourni. Chaque accroche doit être un court paragraphe intrigant. Commence directement par la première accroche, sans phrase d'introduction.",
+        # The goal and the task must ask for the same number of hooks.
+        goal=AGENTS["ideateur"]["goal"].format(hook_count=hook_count),
+        **state["user_context"]
+    ):
+        task_ideation_output += chunk
+        # Only paragraphs followed by a blank line are complete; the last one may still grow.
+        paragraphs = task_ideation_output.split('\n\n')[:-1]
+        complete_hooks = [hook.strip() for hook in paragraphs if hook.strip()]
+        for hook in complete_hooks[len(hooks):]:
+            if not hooks and state["speculative_steps"]:
+                _start_speculation(state, hook)
+            hooks.append(hook)
+            yield _markdown(hook)
+
+    outputs["ideation"] = task_ideation_output
+    last_hook = task_ideation_output.split('\n\n')[-1].strip()
+    if last_hook:
+        hooks.append(last_hook)
+        yield _markdown(last_hook)
+    elif not hooks:
+        yield _markdown(task_ideation_output)
+    outputs["hooks"] = hooks or [task_ideation_output]
+    outputs["accroche"] = outputs["hooks"][0]
 
-    # --- Step 2: Generate Title ---
+def _step_titre(state):
+    outputs = state["outputs"]
     task_titre_output = _run_task(
+        state,
         "generateur_titre",
         "En te basant sur l'accroche de scénario suivante, génère 5 propositions de titres percutants. Ne retourne que les titres, un par ligne, sans introduction ni numérotation.",
-        language,
-        accroche_selectionnee=accroche_selectionnee
+        accroche_selectionnee=outputs["accroche"]
     )
     # Select the first title and remove potential markdown (like asterisks)
     titres = [t.strip().replace('*', '') for t in task_titre_output.split('\n') if t.strip()]
-    titre_selectionne = titres[0] if titres else "Scénario Sans Titre"
-    yield f"<h1>{html.escape(titre_selectionne)}</h1>"
-    # Task 2: Create the Antagonist
-    task_antagoniste_output = _run_task(
+    outputs["titre"] = titres[0] if titres else "Scénario Sans Titre"
+    return f"<h1>{html.escape(outputs['titre'])}</h1>"
+
+def _step_antagoniste(state):
+    outputs = state["outputs"]
+    variant_note, variant_kwargs = _variant_context(state)
+    outputs["antagoniste"] = _run_task(
+        state,
         "stratege",
-        "En te basant sur l'accroche sélectionnée et le contexte général fourni par l'utilisateur, développe l'antagoniste principal. Ne fais pas de phrase d'introduction ou de remarques. Crée une fiche descriptive complète pour cet antagoniste (motivations, méthodes, etc.).",
-        language,
-        **user_context,
-        accroche_selectionnee=accroche_selectionnee
+        "En te basant sur l'accroche sélectionnée et le contexte général fourni par l'utilisateur, développe l'antagoniste principal. Ne fais pas de phrase d'introduction ou de remarques. Crée une fiche descriptive complète pour cet antagoniste (motivations, méthodes, etc.)." + variant_note,
+        **state["user_context"],
+        accroche_selectionnee=outputs["accroche"],
+        **variant_kwargs
     )
-    yield f"{markdown2.markdown(task_antagoniste_output, extras=markdown_options)}"
-    # Task 3: Build the World Context
-    task_contexte_output = _run_task(
+    return _markdown(outputs["antagoniste"])
+
+def _step_contexte_monde(state):
+    outputs = state["outputs"]
+    outputs["contexte_monde"] = _run_task(
+        state,
         "contextualisateur",
         "À partir de l'accroche, de l'antagoniste et du contexte utilisateur, construis le contexte du monde. Ne fais pas de phrase d'introduction ou de remarques. Décris l'environnement et le climat social/politique dans un seul paragraphe puis les raisons pour lesquelles l'intrigue se déclenche maintenant. Limite les textes à environ 500 mots.",
-        language,
-        **user_context,
-        accroche=accroche_selectionnee,
-        antagoniste=task_antagoniste_output
+        **state["user_context"],
+        accroche=outputs["accroche"],
+        antagoniste=outputs["antagoniste"]
     )
-    yield f'<h2 class="centered-title">Contexte du Monde</h2>{markdown2.markdown(task_contexte_output, extras=markdown_options)}'
-    # Task 4: Write the Synopsis
-    task_synopsis_output = _run_task(
+    return f'<h2 class="centered-title">Contexte du Monde</h2>{_markdown(outputs["contexte_monde"])}'
+
+def _step_synopsis(state):
+    outputs = state["outputs"]
+    variant_note, variant_kwargs = _variant_context(state)
+    outputs["synopsis"] = _run_task(
+        state,
         "dramaturge",
-        "Synthétise toutes les informations (contexte utilisateur, accroche, antagoniste, contexte du monde) pour écrire un synopsis global de l'histoire (300-400 mots) avec un début, un milieu et une fin clairs. Ne fais pas de phrase d'introduction ou de remarques.",
-        language,
-        **user_context,
-        accroche=accroche_selectionnee,
-        antagoniste=task_antagoniste_output,
-        contexte_monde=task_contexte_output
+        "Synthétise toutes les informations (contexte utilisateur, accroche, antagoniste, contexte du monde) pour écrire un synopsis global de l'histoire (300-400 mots) avec un début, un milieu et une fin clairs. Ne fais pas de phrase d'introduction ou de remarques." + variant_note,
+        **state["user_context"],
+        accroche=outputs["accroche"],
+        antagoniste=outputs["antagoniste"],
+        contexte_monde=outputs["contexte_monde"],
+        **variant_kwargs
     )
-    yield f'<h2 class="centered-title">Synopsis</h2>{markdown2.markdown(task_synopsis_output, extras=markdown_options)}'
-    # Task 5: Outline the Scenes
-    task_decoupage_scenes_output = _run_task(
+    return f'<h2 class="centered-title">Synopsis</h2>{_markdown(outputs["synopsis"])}'
+
+def _step_decoupage_scenes(state):
+    outputs = state["outputs"]
+    outputs["decoupage_scenes"] = _run_task(
+        state,
         "metteur_en_scene",
         "En te basant sur le synopsis, découpe l'histoire en une liste de scènes clés. Pour chaque scène, donne un titre court et descriptif. La liste doit suivre une progression logique. Ne fais pas de phrase d'introduction ou de remarques.",
-        language,
-        **user_context,
-        synopsis=task_synopsis_output
+        **state["user_context"],
+        synopsis=outputs["synopsis"]
     )
-    yield f"{markdown2.markdown(task_decoupage_scenes_output, extras=markdown_options)}"
-    # Task 7: Detail all scenes
-    task_detail_scenes_output = _run_task(
+    return _markdown(outputs["decoupage_scenes"])
+
+def _step_scenes_detaillees(state):
+    outputs = state["outputs"]
+    outputs["scenes_detaillees"] = _run_task(
+        state,
         "specialiste_scene",
         "Pour CHAQUE scène listée dans le découpage, écris une description détaillée (objectif, obstacles, ambiance, issues possibles). Ne fais pas de phrase d'introduction ou de remarques. Commence directement par la description de la première scène en mettant en avant le titre puis les éléments descriptifs à la ligne sous forme de liste. Utilise un titre et une présentation ou chaque nouvel élément doit être mis à la ligne pour une présentation en liste",
-        language,
-        **user_context,
-        decoupage_scenes=task_decoupage_scenes_output
+        **state["user_context"],
+        decoupage_scenes=outputs["decoupage_scenes"]
     )
-    processed_scenes_output = task_detail_scenes_output.replace('\n', '\n\n')
-    yield f'<h2 class="centered-title">Scènes</h2><div class="scenes-section">{markdown2.markdown(processed_scenes_output, extras=markdown_options)}</div>'
-    # Task 8: Create NPCs
-    task_architecte_pnj_output = _run_task(
+    processed_scenes_output = outputs["scenes_detaillees"].replace('\n', '\n\n')
+    return f'<h2 class="centered-title">Scènes</h2><div class="scenes-section">{_markdown(processed_scenes_output)}</div>'
+
+def _step_pnj(state):
+    outputs = state["outputs"]
+    outputs["pnj"] = _run_task(
+        state,
         "architecte_pnj",
         "En te basant sur le synopsis et les scènes détaillées, identifie 3 à 5 PNJ majeurs et crée une fiche descriptive pour chacun. Ne fais pas de phrase d'introduction ou de remarques. Commence directement par la description du premier PNJ en mettant en avant le nom en gras puis les éléments descriptifs à la ligne. Chaque partie doit aussi avoir un titre en gras.",
-        language,
-        **user_context,
-        synopsis=task_synopsis_output,
-        scenes_detaillees=task_detail_scenes_output
+        **state["user_context"],
+        synopsis=outputs["synopsis"],
+        scenes_detaillees=outputs["scenes_detaillees"]
     )
-    processed_pnj_output = task_architecte_pnj_output.replace('\n', '\n\n')
-    yield f'<h2 class="centered-title">PNJ</h2><div class="npcs-section">{markdown2.markdown(processed_pnj_output, extras=markdown_options)}</div>'
-    # Task 9: Create Locations
-    task_architecte_lieux_output = _run_task(
+    processed_pnj_output = outputs["pnj"].replace('\n', '\n\n')
+    return f'<h2 class="centered-title">PNJ</h2><div class="npcs-section">{_markdown(processed_pnj_output)}</div>'
+
+def _step_lieux(state):
+    outputs = state["outputs"]
+    outputs["lieux"] = _run_task(
+        state,
         "architecte_lieux",
         "En te basant sur le synopsis et les scènes détaillées, identifie 3 à 5 lieux importants et écris une description détaillée pour chacun. Ne fais pas de phrase d'introduction ou de remarques. Commence directement par la description du premier lieu en mettant en avant le titre en gras puis les éléments descriptifs à la ligne. Chaque partie doit aussi avoir un titre en gras.",
-        language,
-        **user_context,
-        synopsis=task_synopsis_output,
-        scenes_detaillees=task_detail_scenes_output
+        **state["user_context"],
+        synopsis=outputs["synopsis"],
+        scenes_detaillees=outputs["scenes_detaillees"]
     )
-    processed_lieux_output = task_architecte_lieux_output.replace('\n', '\n\n')
-    yield f'<h2 class="centered-title">Lieux</h2><div class="places-section">{markdown2.markdown(processed_lieux_output, extras=markdown_options)}</div>'
+    processed_lieux_output = outputs["lieux"].replace('\n', '\n\n')
+    return f'<h2 class="centered-title">Lieux</h2><div class="places-section">{_markdown(processed_lieux_output)}</div>'
 
-    # --- Final Step: User Inputs Recap ---
+def _step_recap(state):
     user_inputs_html = '<h2 class="centered-title">Récapitulatif des Entrées Utilisateur</h2><ul>'
-    for key, value in user_context.items():
+    for key, value in state["user_context"].items():
         user_inputs_html += f"<li><strong>{key.replace('_', ' ').capitalize()}:</strong> {html.escape(str(value))}</li>"
     user_inputs_html += "</ul>"
-    yield user_inputs_html
+    return user_inputs_html
+
+PIPELINE = [
+    ("ideation", _step_ideation),
+    ("titre", _step_titre),
+    ("antagoniste", _step_antagoniste),
+    ("contexte_monde", _step_contexte_monde),
+    ("synopsis", _step_synopsis),
+    ("decoupage_scenes", _step_decoupage_scenes),
+    ("scenes_detaillees", _step_scenes_detaillees),
+    ("pnj", _step_pnj),
+    ("lieux", _step_lieux),
+    ("recap", _step_recap),
+]
+STEP_NAMES = [name for name, _ in PIPELINE]
+
+def _new_state(llm, inputs, language, outputs, callbacks, metrics=None, speculative_steps=()):
+    # Extract user inputs with defaults for safety
+    user_context = {
+        "game_system": inputs.get("game_system", "Non spécifié"),
+        "player_count": inputs.get("player_count", "Non spécifié"),
+        "theme_tone": inputs.get("theme_tone", "Non spécifié"),
+        "core_idea": inputs.get("core_idea", "Non spécifié"),
+        "constraints": inputs.get("constraints", "Aucune"),
+        "key_elements": inputs.get("key_elements", "Non spécifiés"),
+        "elements_to_avoid": inputs.get("elements_to_avoid", "Aucun"),
+    }
+    state = {
+        "llm": llm,
+        "language": language,
+        "callbacks": callbacks,
+        "user_context": user_context,
+        "outputs": outputs if outputs is not None else {},
+        "metrics": metrics if metrics is not None else {},
+        "speculative_steps": list(speculative_steps),
+    }
+    state["metrics"]["speculation"] = {
+        "started": [],
+        "adopted": [],
+        "discarded": [],
+        "time_saved_seconds": 0.0,
+        "wasted_seconds": 0.0,
+    }
+    return state
+
+def _run_pipeline(state, start=0, stop=None):
+    """
+    Runs the steps PIPELINE[start:stop] in order, yielding each HTML brick.
+    A step returns either one brick or an iterator of bricks.
+    """
+    try:
+        for name, step in PIPELINE[start:stop]:
+            speculation = state.get("speculation", {}).pop(name, None)
+            if speculation is not None:
+                yield _adopt_speculation(state, name, speculation)
+            else:
+                result = step(state)
+                if isinstance(result, str):
+                    yield result
+                else:
+                    yield from result
+            # The previous variants only steer the step the variants branch at.
+            state.pop("previous_variants", None)
+    finally:
+        # Speculative steps still pending here will never be used.
+        if state.get("speculation"):
+            _discard_speculation(state)
+
+def generate_scenario(llm, inputs, language="French", outputs=None, callbacks=None, metrics=None, speculative=True):
+    """
+    Generates a scenario by yielding each step as an HTML brick, using a flexible input structure.
+
+    If an `outputs` dict is given, the raw text of each step is stored in it as the
+    generation progresses. `callbacks` are LangChain callback handlers passed to every
+    LLM call (e.g. to collect token usage).
+
+    With `speculative`, the title and antagonist steps start (one after the other) as soon as
+    the first hook has been streamed, instead of waiting for the whole ideation output. Speculation statistics
+    (time saved, wasted time) are stored in `metrics["speculation"]` if a dict is given.
+    """
+    speculative_steps = SPECULATIVE_STEPS if speculative else ()
+    state = _new_state(llm, inputs, language, outputs, callbacks, metrics, speculative_steps)
+    yield from _run_pipeline(state)
+
+def generate_variants(llm, inputs, variant_count=3, branch_at="hook", language="French", callbacks=None, metrics=None):
+    """
+    Generates several variants of a scenario that share every step before `branch_at`
+    ("hook", "antagonist" or "synopsis"). The shared steps run once, then the variants
+    run concurrently. When branching at the antagonist or synopsis, that step runs for
+    one variant after the other, each seeing the previous ones so it can differ from them.
+
+    Yields (variant_index, html_brick) tuples as soon as bricks are ready: variant_index is
+    None for the shared steps, and each variant's bricks arrive in pipeline order. The recap
+    of user inputs is shared too, and comes last once every variant is done.
+    When branching at the hook, each variant uses a different ideation hook, so there are
+    at most as many variants as hooks returned.
+
+    Steps of the shared prefix that only depend on the hook are speculatively started
+    during ideation, as in generate_scenario; statistics go to `metrics["speculation"]`.
+    """
+    if branch_at not in BRANCH_POINTS:
+        raise ValueError(f"Unknown branch point '{branch_at}'. Expected one of: {', '.join(BRANCH_POINTS)}")
+    if variant_count < 1:
+        raise ValueError("variant_count must be at least 1.")
+
+    branch_index = STEP_NAMES.index(BRANCH_POINTS[branch_at])
+    # Only speculate on steps that are part of the shared prefix.
+    speculative_steps = [name for name in SPECULATIVE_STEPS if STEP_NAMES.index(name) < branch_index]
+    state = _new_state(llm, inputs, language, None, callbacks, metrics, speculative_steps)
+    if branch_at == "hook":
+        state["hook_count"] = str(variant_count)
+
+    # --- Shared prefix, computed once ---
+    for html_brick in _run_pipeline(state, stop=branch_index):
+        yield None, html_brick
+
+    hooks = state["outputs"]["hooks"]
+    if branch_at == "hook":
+        variant_count = min(variant_count, len(hooks))
+
+    branch_key = STEP_NAMES[branch_index]
+    # The recap only depends on the user inputs, so it is shared rather than repeated.
+    recap_index = STEP_NAMES.index("recap")
+    branch_states = []
+    for i in range(variant_count):
+        branch_state = dict(state, outputs=dict(state["outputs"]))
+        if branch_at == "hook":
+            branch_state["outputs"]["accroche"] = hooks[i]
+        branch_states.append(branch_state)
+
+    # --- Variant suffixes, run concurrently ---
+    bricks = queue.Queue()
+    finished = object()
+    # Set when the variants are abandoned (a branch failed or the consumer stopped).
+    cancelled = threading.Event()
+
+    def run_branch(i, branch_state, start):
+        try:
+            if not cancelled.is_set():
+                for html_brick in _run_pipeline(branch_state, start=start, stop=recap_index):
+                    bricks.put((i, html_brick))
+                    # The next step only runs when the loop resumes, so stop here if abandoned.
+                    if cancelled.is_set():
+                        break
+        except Exception as e:
+            bricks.put((i, e))
+        bricks.put((i, finished))
+
+    executor = ThreadPoolExecutor(max_workers=variant_count)
+    try:
+        if branch_at == "hook":
+            for i, branch_state in enumerate(branch_states):
+                executor.submit(run_branch, i, branch_state, branch_index)
+        else:
+            previous_variants = []
+            for i, branch_state in enumerate(branch_states):
+                branch_state["previous_variants"] = list(previous_variants)
+                for html_brick in _run_pipeline(branch_state, start=branch_index, stop=branch_index + 1):
+                    yield i, html_brick
+                previous_variants.append(branch_state["outputs"][branch_key])
+                executor.submit(run_branch, i, branch_state, branch_index + 1)
+        remaining = variant_count
+        while remaining:
+            i, item = bricks.get()
+            if item is finished:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield i, item
+        for html_brick in _run_pipeline(state, start=recap_index):
+            yield None, html_brick
+    finally:
+        cancelled.set()
+        executor.shutdown(wait=False)